@@ -1,7 +1,16 @@
 import os
+import sys  # for line cache sizes and string interning
+import io  # for in-memory archive members
+import tarfile
+import zipfile
+import zlib  # for corrupt archive errors
 import pandas as pd
 import datetime  # for timestamp
 import math  # for halstead
+import heapq  # for top-K worst functions
+import collections  # for line cache LRU
+import random  # for sampling mode
+import time  # for sampling time budget
 
 from tabulate import tabulate  # for pretty print
 
@@ -23,12 +32,32 @@ class FileReader:
         with open(filepath, "r") as file:
             lines = file.readlines()
 
-            # remove blank lines and lower case
-            stripped_lines = []
-            for line in lines:
-                stripped_line = line.strip().lower()
-                if stripped_line:
-                    stripped_lines.append(stripped_line)
+        return self.strip_lines(filepath, lines)
+
+    def read_and_strip_buffer(self, member_name: str, buffer: bytes) -> dict:
+        """
+        Same as read_and_strip_file, but for file contents already held in memory,
+        e.g. a member read out of an archive.
+
+        Args:
+            member_name (str): The path of the member, used for filename and extension.
+            buffer (bytes): The raw contents of the member.
+
+        Returns:
+            dict: Same keys as read_and_strip_file.
+        """
+        text = io.TextIOWrapper(io.BytesIO(buffer), encoding="utf-8", errors="replace")
+        lines = text.readlines()
+
+        return self.strip_lines(member_name, lines)
+
+    def strip_lines(self, filepath: str, lines: list) -> dict:
+        # remove blank lines and lower case
+        stripped_lines = []
+        for line in lines:
+            stripped_line = line.strip().lower()
+            if stripped_line:
+                stripped_lines.append(stripped_line)
 
         filename = os.path.basename(filepath).lower()
         file_extension = os.path.splitext(filename)[1].lower()
@@ -43,6 +72,148 @@ class FileReader:
         return file_and_contents
 
 
+class ArchiveReader:
+    # wheels are zips. tar covers the compressed variants through tarfile's "r:*" mode
+    zip_extensions = (".zip", ".whl")
+    tar_extensions = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+    # corrupt or misnamed archives, encrypted zip members (RuntimeError), truncated streams
+    read_errors = (
+        zipfile.BadZipFile,
+        tarfile.TarError,
+        RuntimeError,
+        OSError,
+        EOFError,
+        zlib.error,
+    )
+
+    def is_archive(self, filepath: str) -> bool:
+        return filepath.lower().endswith(self.zip_extensions + self.tar_extensions)
+
+    def iter_members(self, archive_path: str, handled_extensions: tuple):
+        """
+        Walks the handled members of an archive without extracting to disk.
+
+        Members are filtered by name and size from their headers, before read() is called.
+        For .zip, .whl and plain .tar only the headers are read, so skipped members cost
+        nothing. A compressed tar (.tar.gz/.bz2/.xz) is a single stream, so reaching each
+        header still decompresses every member body in front of it, skipped or not. It is
+        never written to disk or kept in memory, though.
+
+        Args:
+            archive_path (str): The path to the .zip, .whl or .tar(.gz/.bz2/.xz) file.
+            handled_extensions (tuple): Member extensions to read, e.g. (".py", ".r", ".sql").
+
+        Yields:
+            tuple: (member_path, member_name, size_in_bytes, read), where member_path is
+                "archive!member" and read() returns that one member's bytes.
+        """
+        if archive_path.lower().endswith(self.zip_extensions):
+            with zipfile.ZipFile(archive_path) as archive:
+                # infolist comes from the central directory, so filtering here reads headers only
+                for member in archive.infolist():
+                    if member.is_dir() or not member.filename.lower().endswith(
+                        handled_extensions
+                    ):
+                        continue
+                    yield (
+                        self.member_path(archive_path, member.filename),
+                        member.filename,
+                        member.file_size,
+                        lambda member=member: archive.read(member),
+                    )
+        else:
+            with tarfile.open(archive_path, "r:*") as archive:
+                # plain .tar: walking the headers seeks past the bodies. compressed tars cannot
+                # seek, so the whole stream (skipped members too) is decompressed on the way
+                for member in archive:
+                    if not member.isfile() or not member.name.lower().endswith(
+                        handled_extensions
+                    ):
+                        continue
+                    yield (
+                        self.member_path(archive_path, member.name),
+                        member.name,
+                        member.size,
+                        lambda member=member: archive.extractfile(member).read(),
+                    )
+
+    def member_path(self, archive_path, member_name):
+        return f"{archive_path}!{member_name}"
+
+
+class GeneratedFileClassifier:
+    """
+    Cheaply flags generated, minified or binary files from their first few KB.
+
+    A single minified bundle or generated seed file can take longer to score than the rest
+    of a repo, and its metrics say nothing about code anyone maintains.
+    """
+
+    head_bytes = 8192
+    generated_markers = (
+        b"@generated",
+        b"do not edit",
+        b"auto-generated",
+        b"autogenerated",
+        b"code generated by",
+        b"generated by the protocol buffer compiler",
+        b"sourcemappingurl=",
+    )
+    marker_lines = 10  # generated markers only count in the first lines
+    min_head_bytes = 2048  # smaller files are only checked for markers and null bytes
+    max_line_length = 1000  # any line longer than this, minified
+    max_mean_line_length = 200  # typical hand written code is well under 80
+    max_entropy = 6.0  # bits per byte. source code sits around 4.5-5, base64 and binary above 6
+
+    def classify(self, head: bytes):
+        """
+        Args:
+            head (bytes): The first head_bytes of the file.
+
+        Returns:
+            str: Why the file looks generated, minified or binary, or None if it looks hand written.
+        """
+        if not head:
+            return None
+        if b"\x00" in head:
+            return "binary (null bytes)"
+
+        lines = head.split(b"\n")
+
+        # generators announce themselves in the header comment, so only look at the top
+        lowered_top = b"\n".join(lines[: self.marker_lines]).lower()
+        for marker in self.generated_markers:
+            if marker in lowered_top:
+                return f"generated (marker {marker.decode()!r})"
+
+        # a short file is one or two hand written statements as often as it is minified, so
+        # line length and entropy only say something once there is enough text to go on
+        if len(head) < self.min_head_bytes:
+            return None
+
+        if len(head) == self.head_bytes and len(lines) > 1:
+            lines = lines[:-1]  # the last line was cut by the read, so its length is unknown
+        longest_line = max(len(line) for line in lines)
+        if longest_line > self.max_line_length:
+            return f"minified (line of {longest_line}+ chars)"
+        mean_line_length = len(head) / len(lines)
+        if mean_line_length > self.max_mean_line_length:
+            return f"minified (mean line {int(mean_line_length)} chars)"
+
+        entropy = self.entropy(head)
+        if entropy > self.max_entropy:
+            return f"encoded or binary (entropy {entropy:.2f} bits/byte)"
+
+        return None
+
+    def entropy(self, data: bytes):
+        """Shannon entropy, in bits per byte."""
+        counts = collections.Counter(data)
+        return -sum(
+            (count / len(data)) * math.log2(count / len(data)) for count in counts.values()
+        )
+
+
 class CodeSplitter:
     def split_into_code_lines_and_comment_lines(
         self, lines: list, file_extension: str
@@ -79,8 +250,9 @@ class CodeSplitter:
             comment_block_start = "/*"
             comment_block_stop = "*/"
         else:
+            # no comment syntax known, so count everything as code rather than fail
             print("Unhandled file extension")
-            exit
+            return list(lines), []
 
         code_lines = []
         comment_lines = []
@@ -88,6 +260,7 @@ class CodeSplitter:
         previous_line = None  # placeholder before being called in loop
 
         for line in lines:
+            appended_block_start = False
             # parsing python is difficult due to whitespace, no returns, many docstrings, etc. so wishy washy...
             # check for start of docstring
             if (
@@ -116,20 +289,17 @@ class CodeSplitter:
             elif line.startswith(comment_block_start):
                 in_comment_block = True
                 comment_lines.append(line)
+                appended_block_start = True
             # check for comment block end
             if in_comment_block:
                 # which start and stop with the same string
                 if line.endswith(comment_block_stop):
                     in_comment_block = False
-                    # this prevents double appending a multiline comment blocks
-                    # with starts AND ends with a multiline comments, e.g. /* hello world */
-                    if line not in comment_lines:
-                        comment_lines.append(line)
-                else:
-                    # this prevents double appending a multiline comment blocks
-                    # with starts AND ends with a multiline comments, e.g. /* hello world */
-                    if line not in comment_lines:
-                        comment_lines.append(line)
+                # this prevents double appending a multiline comment blocks
+                # with starts AND ends with a multiline comments, e.g. /* hello world */
+                # a flag rather than searching comment_lines, which was quadratic on long blocks
+                if not appended_block_start:
+                    comment_lines.append(line)
                 continue
 
             # if not in a comment block, categorize as code or comment line
@@ -264,9 +434,100 @@ class FunctionExtractor:
         return functions
 
 
+class LineCache:
+    """
+    Bounded LRU cache from (file_extension, line) to that line's precomputed metric inputs.
+
+    Real code repeats lines heavily (returns, closing braces, imports, boilerplate SQL
+    clauses), and every function is scored once for itself and again inside _FILE_TOTAL,
+    so the same line is split and classified many times per run.
+    """
+
+    def __init__(self, max_entries=100_000, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes  # approximate, from sys.getsizeof of the cached objects
+        self.entries = collections.OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        size = self.entry_size(key, value)
+        if size > self.max_bytes:
+            return  # never cache a line that would flush everything else
+        # replacing an entry must release its old size, or the byte count drifts upward
+        existing_value = self.entries.pop(key, None)
+        if existing_value is not None:
+            self.bytes -= self.entry_size(key, existing_value)
+        self.entries[key] = value
+        self.bytes += size
+        while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+            evicted_key, evicted_value = self.entries.popitem(last=False)
+            self.bytes -= self.entry_size(evicted_key, evicted_value)
+            self.evictions += 1
+
+    def entry_size(self, key, value):
+        return sys.getsizeof(key[1]) + sum(sys.getsizeof(item) for item in value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups > 0 else None,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+
 class CodeMetricsCalculator:
-    def __init__(self):
+    halstead_operators = frozenset(
+        [
+            "+",
+            "-",
+            "*",
+            "/",
+            "%",
+            "=",  # arithmetic
+            "==",
+            "!=",
+            "<",
+            ">",
+            "<=",
+            ">=",  # comparisons
+            "and ",
+            "& ",
+            "or ",
+            "| ",
+            "not ",
+            "!",  # logic
+            "if ",
+            "else ",
+            "while ",
+            "for ",
+            "def ",
+            "function ",
+            "return ",
+        ]  # keywords
+    )
+
+    deadline_check_lines = 1000  # how often a long chunk checks its time budget
+
+    def __init__(self, line_cache=None):
         self.code_splitter = CodeSplitter()  # create an instance of CodeSplitter
+        # shared by every metric, and across functions and files
+        self.line_cache = line_cache if line_cache is not None else LineCache()
 
     def count_lines_of_code(self, lines, file_extension):
         """
@@ -304,6 +565,68 @@ class CodeMetricsCalculator:
 
         return loc
 
+    def calc_chunk_metrics(self, lines, file_extension):
+        """
+        Returns loc, cyclomatic complexity and the halstead tokens of a chunk of lines in one
+        pass: the chunk is split into code and comments once, and each code line is looked up
+        in the line cache once.
+
+        Same results as count_lines_of_code, calc_cyclomatic_complexity and tokenize_halstead.
+        """
+        return self.calc_chunk_metrics_until(lines, file_extension)[:4]
+
+    def calc_chunk_metrics_until(self, lines, file_extension, deadline=None):
+        """
+        calc_chunk_metrics, but stops classifying code lines once deadline (time.monotonic)
+        has passed, checked every deadline_check_lines lines, so a single huge chunk (a .sql
+        file is always one) cannot run over its time budget.
+
+        Returns:
+            tuple: (loc, cyclomatic complexity, operator tokens, operand tokens, number of
+                code lines classified). loc always covers the whole chunk; complexity and tokens
+                only cover the code lines classified, fewer than loc_code when cut.
+        """
+        (
+            code_lines,
+            comment_lines,
+        ) = self.code_splitter.split_into_code_lines_and_comment_lines(
+            lines, file_extension
+        )
+        loc = {
+            "loc_total": len(lines),
+            "loc_code": len(code_lines),
+            "loc_comments": len(comment_lines),
+        }
+        print(loc)
+
+        cyclomatic_complexity = 1  # base complexity
+        N1_operators_total = list()
+        N2_operands_total = list()
+        code_lines_scored = 0
+        for line in code_lines:
+            if (
+                deadline is not None
+                and code_lines_scored > 0
+                and code_lines_scored % self.deadline_check_lines == 0
+                and time.monotonic() > deadline
+            ):
+                break
+            operators, operands, decision_points = self.profile_line(
+                line, file_extension
+            )
+            cyclomatic_complexity += decision_points
+            N1_operators_total.extend(operators)
+            N2_operands_total.extend(operands)
+            code_lines_scored += 1
+
+        return (
+            loc,
+            cyclomatic_complexity,
+            N1_operators_total,
+            N2_operands_total,
+            code_lines_scored,
+        )
+
     def calc_cyclomatic_complexity(self, lines, file_extension):
         # flat is better. Rotate python code 90 degrees counter clockwise, and the mountain range indicates challenge
         # check gitblame to see why complications are added
@@ -317,10 +640,16 @@ class CodeMetricsCalculator:
 
         cyclomatic_complexity = 1  # base complexity
 
+        for line in code_lines:
+            cyclomatic_complexity += self.profile_line(line, file_extension)[2]
+
+        return cyclomatic_complexity
+
+    def control_flow_keywords(self, file_extension):
         # conditionally search for language specific control flow keywords
         if file_extension == ".py":
             # TODO: improve according to https://radon.readthedocs.io/en/latest/intro.html#cyclomatic-complexity
-            control_flow_keywords = (
+            return (
                 "if ",
                 "elif ",
                 "for ",
@@ -334,9 +663,9 @@ class CodeMetricsCalculator:
                 "lambda ",
             )
         elif file_extension == ".r" or file_extension == ".rmd":
-            control_flow_keywords = ("if ", "else if ", "while ", "for ")
+            return ("if ", "else if ", "while ", "for ")
         elif file_extension == ".sql":
-            control_flow_keywords = (
+            return (
                 "select ",
                 "from ",
                 "where ",
@@ -350,16 +679,33 @@ class CodeMetricsCalculator:
                 "intersect ",
             )
         else:
-            decision_points = ()
+            return ()
 
-        for line in code_lines:
-            decision_points = 0
-            for control_flow_keyword in control_flow_keywords:
-                decision_points += line.count(control_flow_keyword)
-
-            cyclomatic_complexity += decision_points
-
-        return cyclomatic_complexity
+    def profile_line(self, line, file_extension):
+        """
+        Returns (operator tokens, operand tokens, decision points) for one code line,
+        from the line cache when the same line has been seen before.
+        """
+        key = (file_extension, line)
+        profile = self.line_cache.get(key)
+        if profile is not None:
+            return profile
+
+        operators = []
+        operands = []
+        for token in line.split():
+            if token in self.halstead_operators:
+                operators.append(sys.intern(token))
+            elif token.isalnum():
+                operands.append(sys.intern(token))
+
+        decision_points = 0
+        for control_flow_keyword in self.control_flow_keywords(file_extension):
+            decision_points += line.count(control_flow_keyword)
+
+        profile = (tuple(operators), tuple(operands), decision_points)
+        self.line_cache.put(key, profile)
+        return profile
 
     def calc_halstead_metrics(self, lines, file_extension):
         # halstead metrics been around 50 years
@@ -373,38 +719,21 @@ class CodeMetricsCalculator:
         # difficulty = (distinct(operators) / 2) x (distinct(operands) / sum(operands)) = calulation of how youd reuse code and how much code you used to solve it
         # effort = volume x difficulty?
 
-        N1_operators_total = list()
-        N2_operands_total = (
-            list()
-        )  # lists are not distinct (total), which halstead equation requires
+        N1_operators_total, N2_operands_total = self.tokenize_halstead(
+            lines, file_extension
+        )
 
-        operators = [
-            "+",
-            "-",
-            "*",
-            "/",
-            "%",
-            "=",  # arithmetic
-            "==",
-            "!=",
-            "<",
-            ">",
-            "<=",
-            ">=",  # comparisons
-            "and ",
-            "& ",
-            "or ",
-            "| ",
-            "not ",
-            "!",  # logic
-            "if ",
-            "else ",
-            "while ",
-            "for ",
-            "def ",
-            "function ",
-            "return ",
-        ]  # keywords
+        return self.calc_halstead_from_tokens(N1_operators_total, N2_operands_total)
+
+    def tokenize_halstead(self, lines, file_extension):
+        """
+        Returns the operator and operand tokens of the code lines, as two lists.
+
+        Lists are not distinct (total), which halstead equation requires. Keeping the
+        tokens rather than the metrics lets chunks of a file be combined afterwards.
+        """
+        N1_operators_total = list()
+        N2_operands_total = list()
 
         (
             code_lines,
@@ -413,15 +742,13 @@ class CodeMetricsCalculator:
             lines, file_extension
         )  # halstead ignores comments
         for line in code_lines:
-            tokens = line.split()
-            for token in tokens:
-                if token in operators:
-                    N1_operators_total.append(token)
-                elif token.isalnum():
-                    N2_operands_total.append(token)
-                else:
-                    continue
+            operators, operands, _ = self.profile_line(line, file_extension)
+            N1_operators_total.extend(operators)
+            N2_operands_total.extend(operands)
+
+        return N1_operators_total, N2_operands_total
 
+    def calc_halstead_from_tokens(self, N1_operators_total, N2_operands_total):
         # use set to make distinct
         n1_operators_distinct = set(N1_operators_total)
         n2_operands_distinct = set(N2_operands_total)
@@ -496,6 +823,9 @@ class CodeMetricsCalculator:
         # based on halstead metrics
         # more syntax/variables, more nesting, more code = unmaintainable
         # fewer syntax/vafiables, flat code, shorter code = maintainable
+        # log(0) is undefined, e.g. for a chunk that is all comments, so floor both at 1
+        v_volume = max(v_volume, 1)
+        loc = max(loc, 1)
         maintainability_index = int(
             max(
                 0,
@@ -517,12 +847,459 @@ class CodeMetricsCalculator:
         return maintainability_index
 
 
+class QuantileSketch:
+    """
+    Mergeable streaming quantile sketch, in the style of DDSketch.
+
+    Non-negative values are counted into logarithmic buckets, so any quantile is
+    returned within relative_accuracy of the true value, memory grows with the
+    range of values rather than their count, and two sketches merge by adding
+    bucket counts.
+    """
+
+    def __init__(self, relative_accuracy=0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = {}
+        self.zero_count = 0  # log bucket of 0 is undefined, so zeros are counted apart
+        self.count = 0
+
+    def add(self, value):
+        if value <= 0:
+            self.zero_count += 1
+        else:
+            key = math.ceil(math.log(value) / self.log_gamma)
+            self.buckets[key] = self.buckets.get(key, 0) + 1
+        self.count += 1
+
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("cannot merge sketches with different relative accuracy")
+        for key, bucket_count in other.buckets.items():
+            self.buckets[key] = self.buckets.get(key, 0) + bucket_count
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0
+        cumulative = self.zero_count
+        for key in sorted(self.buckets):
+            cumulative += self.buckets[key]
+            if cumulative > rank:
+                # midpoint of the bucket (gamma^(key-1), gamma^key]
+                return 2 * self.gamma**key / (self.gamma + 1)
+
+
+class RunningStats:
+    """Mergeable count, sum, mean and max per metric, plus a maintainability sketch."""
+
+    metrics = (
+        "loc_total",
+        "loc_code",
+        "loc_comments",
+        "cyclocomplexity",
+        "v_volume",
+        "e_effort",
+        "bugs_deliver_b",
+        "maintainability_index",
+    )
+    quantiles = (0.1, 0.5, 0.9)
+
+    def __init__(self):
+        self.count = 0
+        self.sums = {metric: 0 for metric in self.metrics}
+        self.maxima = {metric: None for metric in self.metrics}
+        self.maintainability_sketch = QuantileSketch()
+
+    def add(self, row):
+        self.count += 1
+        for metric in self.metrics:
+            value = row[metric]
+            self.sums[metric] += value
+            if self.maxima[metric] is None or value > self.maxima[metric]:
+                self.maxima[metric] = value
+        self.maintainability_sketch.add(row["maintainability_index"])
+
+    def merge(self, other):
+        self.count += other.count
+        for metric in self.metrics:
+            self.sums[metric] += other.sums[metric]
+            if other.maxima[metric] is not None and (
+                self.maxima[metric] is None or other.maxima[metric] > self.maxima[metric]
+            ):
+                self.maxima[metric] = other.maxima[metric]
+        self.maintainability_sketch.merge(other.maintainability_sketch)
+
+    def summary(self):
+        summary = {"count": self.count}
+        for metric in self.metrics:
+            summary[f"{metric}_sum"] = self.sums[metric]
+            summary[f"{metric}_mean"] = (
+                round(self.sums[metric] / self.count, 2) if self.count > 0 else None
+            )
+            summary[f"{metric}_max"] = self.maxima[metric]
+        for q in self.quantiles:
+            value = self.maintainability_sketch.quantile(q)
+            summary[f"maintainability_index_p{int(q * 100)}"] = (
+                round(value, 1) if value is not None else None
+            )
+        return summary
+
+
+class MetricsRollup:
+    """
+    Keeps directory and package aggregates, and the top-K worst functions, as rows are produced.
+
+    Only the immediate directory of each file is updated while scanning. Parent directories
+    and packages (the first level below the scanned root) are built by merging those at
+    report time, so no pass over output.csv is needed.
+
+    File rows (_FILE_TOTAL) and function rows are kept apart, so that sums cover whole files
+    while means, maxima and maintainability quantiles describe functions.
+    """
+
+    worst_by = ("cyclocomplexity", "e_effort")
+    scopes = ("file", "function")
+
+    def __init__(self, root, top_k=10):
+        self.root = os.path.abspath(root)
+        self.top_k = top_k
+        self.directories = {}  # directory -> {"file": RunningStats, "function": RunningStats}
+        self.worst_functions = {metric: [] for metric in self.worst_by}  # min heaps
+        self.pushed = 0  # tie breaker, so heapq never compares rows
+
+    def add_rows(self, location, rows):
+        """
+        Args:
+            location (str): The directory holding the file, or the archive holding the member.
+            rows (list): The metric rows of a single file, as produced by CodeAnalyzer.
+        """
+        # absolute, so a relative target and its parents share the same keys
+        location = os.path.abspath(location)
+        stats = self.directories.setdefault(
+            location, {scope: RunningStats() for scope in self.scopes}
+        )
+        for row in rows:
+            if row["function_name"] == "_FILE_TOTAL":
+                stats["file"].add(row)
+            else:
+                stats["function"].add(row)
+                self.push_worst(row)
+
+    def push_worst(self, row):
+        for metric, heap in self.worst_functions.items():
+            self.pushed += 1
+            entry = (row[metric], self.pushed, row)
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, entry)
+            elif entry[0] > heap[0][0]:
+                heapq.heapreplace(heap, entry)
+
+    def ancestors(self, location):
+        """The location itself, then each parent directory up to the scanned root."""
+        current = os.path.abspath(location)
+        yield current
+        while current != self.root and current.startswith(self.root):
+            parent = os.path.dirname(current)
+            if parent == current:
+                break
+            current = parent
+            yield current
+
+    def package(self, location):
+        relative_path = os.path.relpath(os.path.abspath(location), self.root)
+        return relative_path.split(os.sep)[0]
+
+    def rollup_records(self):
+        """Returns one record per (level, key, scope), for directories and packages."""
+        rollups = {"directory": {}, "package": {}}
+        for location, stats in self.directories.items():
+            keys = [("directory", key) for key in self.ancestors(location)]
+            keys.append(("package", self.package(location)))
+            for level, key in keys:
+                merged = rollups[level].setdefault(
+                    key, {scope: RunningStats() for scope in self.scopes}
+                )
+                for scope in self.scopes:
+                    merged[scope].merge(stats[scope])
+
+        records = []
+        for level, merged_by_key in rollups.items():
+            for key in sorted(merged_by_key):
+                for scope in self.scopes:
+                    records.append(
+                        {
+                            "level": level,
+                            "key": key,
+                            "scope": scope,
+                            **merged_by_key[key][scope].summary(),
+                        }
+                    )
+        return records
+
+    def top_k_records(self):
+        records = []
+        for metric, heap in self.worst_functions.items():
+            for rank, (value, _, row) in enumerate(sorted(heap, reverse=True), start=1):
+                records.append(
+                    {
+                        "worst_by": metric,
+                        "rank": rank,
+                        "value": value,
+                        "filepath": row["filepath"],
+                        "filename": row["filename"],
+                        "function_name": row["function_name"],
+                        "maintainability_index": row["maintainability_index"],
+                    }
+                )
+        return records
+
+
+class StratifiedSampler:
+    """
+    Draws a seeded random sample of files, stratified by extension and size.
+
+    Size strata are powers of two in KB, so a handful of huge generated files cannot
+    crowd out the many small ones, or the other way round.
+    """
+
+    def __init__(self, files, seed=0):
+        """
+        Args:
+            files (list): (full_filepath, size_in_bytes) tuples, the whole population.
+            seed (int): Seed for the random generator, so that runs are repeatable.
+        """
+        rng = random.Random(seed)
+        self.strata = {}
+        for full_filepath, size in sorted(files):
+            self.strata.setdefault(self.stratum(full_filepath, size), []).append(
+                full_filepath
+            )
+        for stratum in sorted(self.strata):
+            rng.shuffle(self.strata[stratum])
+        self.taken = {stratum: 0 for stratum in self.strata}
+
+    def stratum(self, full_filepath, size):
+        extension = os.path.splitext(full_filepath)[1].lower()
+        size_bucket = (size // 1024).bit_length()  # 0 = under 1KB, 1 = 1-2KB, 2 = 2-4KB...
+        return (extension, size_bucket)
+
+    def strata_sizes(self):
+        return {stratum: len(paths) for stratum, paths in self.strata.items()}
+
+    def initial_sample(self, sample_fraction, min_per_stratum=2):
+        """
+        Proportional allocation, with at least min_per_stratum files from every stratum so
+        its variance can be estimated. Returned round robin across strata, so cutting the
+        list short still covers every stratum.
+        """
+        allocation = {
+            stratum: min(
+                len(paths), max(min_per_stratum, round(sample_fraction * len(paths)))
+            )
+            for stratum, paths in self.strata.items()
+        }
+        sample = []
+        while any(self.taken[stratum] < allocation[stratum] for stratum in self.strata):
+            for stratum in sorted(self.strata):
+                if self.taken[stratum] < allocation[stratum]:
+                    sample.append((stratum, self.strata[stratum][self.taken[stratum]]))
+                    self.taken[stratum] += 1
+        return sample
+
+    def next_file(self):
+        """Grows the sample by one file, from the stratum sampled least so far. None when exhausted."""
+        remaining = [
+            stratum
+            for stratum, paths in self.strata.items()
+            if self.taken[stratum] < len(paths)
+        ]
+        if not remaining:
+            return None
+        stratum = min(
+            sorted(remaining),
+            key=lambda stratum: self.taken[stratum] / len(self.strata[stratum]),
+        )
+        full_filepath = self.strata[stratum][self.taken[stratum]]
+        self.taken[stratum] += 1
+        return stratum, full_filepath
+
+
+class SampleEstimator:
+    """
+    Repo level estimates, with confidence intervals, from a stratified sample of files.
+
+    Totals use the stratified expansion estimator. Per function means and shares are ratios
+    of two estimated totals (e.g. sum of maintainability over count of functions), with
+    variance from the usual linearization. Both include the finite population correction.
+    """
+
+    z = 1.96  # 95% confidence
+
+    def estimate(self, strata_sizes, file_values, complexity_threshold):
+        """
+        Args:
+            strata_sizes (dict): stratum -> number of files in the population.
+            file_values (dict): stratum -> list of per-file dicts with keys
+                'functions', 'maintainability_sum', 'over_threshold' and 'effort'.
+            complexity_threshold (int): The threshold used for 'over_threshold', for labels.
+
+        Returns:
+            list: One dict per estimate, with estimate, ci_low and ci_high.
+        """
+        estimates = [
+            self.ratio(
+                "mean_maintainability_index",
+                strata_sizes,
+                file_values,
+                "maintainability_sum",
+                "functions",
+            ),
+            self.total("total_e_effort", strata_sizes, file_values, "effort"),
+            self.ratio(
+                f"share_functions_cyclocomplexity_over_{complexity_threshold}",
+                strata_sizes,
+                file_values,
+                "over_threshold",
+                "functions",
+            ),
+        ]
+        files_sampled = sum(len(values) for values in file_values.values())
+        files_total = sum(strata_sizes.values())
+        for estimate in estimates:
+            estimate["files_sampled"] = files_sampled
+            estimate["files_total"] = files_total
+        return estimates
+
+    def total(self, name, strata_sizes, file_values, key):
+        total = 0
+        variances = []
+        for stratum, values in file_values.items():
+            ys = [value[key] for value in values]
+            total += strata_sizes[stratum] * sum(ys) / len(ys)
+            variances.append(self.stratum_variance(strata_sizes[stratum], ys))
+        return self.interval(name, total, self.sum_variances(variances))
+
+    def ratio(self, name, strata_sizes, file_values, numerator, denominator):
+        numerator_total, denominator_total = 0, 0
+        for stratum, values in file_values.items():
+            n = len(values)
+            numerator_total += strata_sizes[stratum] * sum(v[numerator] for v in values) / n
+            denominator_total += (
+                strata_sizes[stratum] * sum(v[denominator] for v in values) / n
+            )
+        if denominator_total == 0:
+            return self.interval(name, None, None)
+        ratio = numerator_total / denominator_total
+
+        variances = []
+        for stratum, values in file_values.items():
+            residuals = [v[numerator] - ratio * v[denominator] for v in values]
+            variances.append(self.stratum_variance(strata_sizes[stratum], residuals))
+        variance = self.sum_variances(variances)
+        if variance is None:
+            return self.interval(name, ratio, None)
+        return self.interval(name, ratio, variance / denominator_total**2)
+
+    def stratum_variance(self, population_size, ys):
+        """
+        Variance contributed by one stratum, or None when it cannot be estimated: a single
+        sampled file out of several gives no spread to measure, and claiming zero would
+        report a certain estimate exactly when there is least data.
+        """
+        n = len(ys)
+        if n >= population_size:
+            return 0  # fully sampled, nothing left to estimate
+        if n < 2:
+            return None
+        mean = sum(ys) / n
+        sample_variance = sum((y - mean) ** 2 for y in ys) / (n - 1)
+        finite_population_correction = 1 - n / population_size
+        return population_size**2 * finite_population_correction * sample_variance / n
+
+    def sum_variances(self, variances):
+        # one stratum with unknown variance leaves the whole interval unknown
+        if any(variance is None for variance in variances):
+            return None
+        return sum(variances)
+
+    def interval(self, name, estimate, variance):
+        """Rounded estimate and 95% interval. The interval is None when variance is unknown."""
+        if estimate is None:
+            return {"metric": name, "estimate": None, "ci_low": None, "ci_high": None}
+        if variance is None:
+            return {
+                "metric": name,
+                "estimate": round(estimate, 2),
+                "ci_low": None,
+                "ci_high": None,
+            }
+        margin = self.z * math.sqrt(variance)
+        return {
+            "metric": name,
+            "estimate": round(estimate, 2),
+            "ci_low": round(estimate - margin, 2),
+            "ci_high": round(estimate + margin, 2),
+        }
+
+
 class CodeAnalyzer:
+    output_text_columns = (
+        "run_timestamp",
+        "filepath",
+        "file_extension",
+        "filename",
+        "function_name",
+        "skip_reason",
+    )
+    output_columns = (
+        "run_timestamp",
+        "filepath",
+        "file_extension",
+        "filename",
+        "function_name",
+        "loc_total",
+        "loc_code",
+        "loc_comments",
+        "cyclocomplexity",
+        "n1_operators_distinct",
+        "n2_operands_distinct",
+        "N1_operators_total",
+        "N2_operands_total",
+        "N_program_len",
+        "n_program_vocab",
+        "v_volume",
+        "d_difficulty",
+        "e_effort",
+        "implement_time_t",
+        "bugs_deliver_b",
+        "maintainability_index",
+        "skip_reason",
+    )
+
     # instantiate
-    def __init__(self, target_codepath, directories_to_skip, handled_extensions):
+    def __init__(
+        self,
+        target_codepath,
+        directories_to_skip,
+        handled_extensions,
+        scan_archives=True,
+        top_k=10,
+        line_cache=None,
+        max_file_bytes=5 * 1024 * 1024,
+        max_file_lines=50_000,
+        max_file_seconds=10.0,
+        skip_generated=True,
+    ):
         self.target_codepath = target_codepath
         self.directories_to_skip = directories_to_skip
         self.handled_extensions = handled_extensions
+        self.scan_archives = scan_archives  # analyze .zip/.whl/.tar.gz contents in place
         self.timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         self.module_directory = os.path.dirname(os.path.abspath(__file__))
         self.code_metrics = []
@@ -531,7 +1308,16 @@ class CodeAnalyzer:
         self.function_extractor = (
             FunctionExtractor()
         )  # create an instance of FunctionExtractor
-        self.code_metric_calculator = CodeMetricsCalculator()
+        self.code_metric_calculator = CodeMetricsCalculator(line_cache)
+        self.archive_reader = ArchiveReader()
+        self.top_k = top_k  # how many worst functions to keep, by complexity and by effort
+        self.rollup = MetricsRollup(target_codepath, top_k)
+        # per file budgets, so one pathological file cannot dominate the scan. None disables
+        self.max_file_bytes = max_file_bytes  # larger files are skipped unread
+        self.max_file_lines = max_file_lines  # longer files are truncated
+        self.max_file_seconds = max_file_seconds  # remaining functions are dropped
+        self.skip_generated = skip_generated  # skip generated, minified and binary files
+        self.generated_file_classifier = GeneratedFileClassifier()
 
     def extract_functions(self, file_contents, file_extension):
         """Extract functions from scripts, given file extension."""
@@ -550,26 +1336,217 @@ class CodeAnalyzer:
 
     def collect_code_metrics(self, directory):
         code_metrics = []
+        for full_filepath in self.discover_files(directory):
+            code_metrics.extend(self.collect_file_metrics(full_filepath))
+
+        return code_metrics
+
+    def discover_files(self, directory):
+        """Yields the handled files, and archives if scan_archives, below directory."""
         for root, dirs, files in os.walk(directory):
             filtered_dirs = self.filter_directories(dirs)
             dirs[:] = filtered_dirs
 
             for each_file in files:
-                if each_file.lower().endswith(self.handled_extensions):
-                    full_filepath = os.path.join(root, each_file)
-                    file_and_contents = self.file_reader.read_and_strip_file(
-                        full_filepath
-                    )
-                    functions = self.extract_functions(file_and_contents)
+                if each_file.lower().endswith(self.handled_extensions) or (
+                    self.scan_archives and self.archive_reader.is_archive(each_file)
+                ):
+                    yield os.path.join(root, each_file)
+
+    def collect_file_metrics(self, full_filepath):
+        if self.archive_reader.is_archive(full_filepath):
+            return self.collect_archive_metrics(full_filepath)
+
+        size = os.path.getsize(full_filepath)
+        with open(full_filepath, "rb") as file:
+            head = file.read(self.generated_file_classifier.head_bytes)
+        skip_reason = self.pre_analysis_skip_reason(size, head)
+        if skip_reason:
+            return [self.skipped_row(full_filepath, skip_reason)]
+
+        file_and_contents = self.file_reader.read_and_strip_file(full_filepath)
+        return self.analyze_file(
+            os.path.dirname(full_filepath), full_filepath, file_and_contents
+        )
+
+    def pre_analysis_skip_reason(self, size, head):
+        """Checks the byte budget, then classifies the head of the file. None if it can be analyzed."""
+        if self.max_file_bytes is not None and size > self.max_file_bytes:
+            return f"skipped: {size} bytes > max_file_bytes {self.max_file_bytes}"
+        if self.skip_generated:
+            classification = self.generated_file_classifier.classify(head)
+            if classification:
+                return f"skipped: {classification}"
+        return None
+
+    def skipped_row(self, full_filepath, skip_reason):
+        """A metric-less _FILE_TOTAL row, so skipped files are still visible in output.csv."""
+        if "!" in full_filepath and self.archive_reader.is_archive(
+            full_filepath.split("!", 1)[0]
+        ):
+            filename = os.path.basename(full_filepath.split("!", 1)[1]).lower()
+        else:
+            filename = os.path.basename(full_filepath).lower()
+        print(f"{full_filepath} {skip_reason}")
+        return {
+            "run_timestamp": self.timestamp,
+            "filepath": self.display_filepath(full_filepath),
+            "file_extension": os.path.splitext(filename)[1],
+            "filename": filename,
+            "function_name": "_FILE_TOTAL",
+            "skip_reason": skip_reason,
+        }
+
+    def collect_sampled_metrics(
+        self, directory, sample_fraction, time_budget, seed, complexity_threshold
+    ):
+        """
+        Runs the normal pipeline on a stratified random sample of files only.
+
+        Args:
+            directory (str): The directory to sample from.
+            sample_fraction (float): Share of each stratum to analyze up front. None to
+                start from the minimum of 2 files per stratum.
+            time_budget (float): Seconds. If set, the sample keeps growing one file at a
+                time until the deadline, or until every file is analyzed.
+            seed (int): Seed for the random sample.
+            complexity_threshold (int): Functions above this cyclocomplexity count as complex.
+
+        Returns:
+            tuple: (code_metrics of the sampled files, list of repo level estimates)
+        """
+        deadline = time.monotonic() + time_budget if time_budget is not None else None
+        files = [
+            (full_filepath, os.path.getsize(full_filepath))
+            for full_filepath in self.discover_files(directory)
+        ]
+        sampler = StratifiedSampler(files, seed)
+        sample = sampler.initial_sample(sample_fraction or 0)
+
+        code_metrics = []
+        file_values = {}
+        covered = set()
+        for stratum, full_filepath in sample:
+            # past the deadline, still analyze one file per stratum so every stratum is represented
+            if deadline is not None and time.monotonic() > deadline and stratum in covered:
+                continue
+            rows = self.collect_file_metrics(full_filepath)
+            code_metrics.extend(rows)
+            file_values.setdefault(stratum, []).append(
+                self.sample_values(rows, complexity_threshold)
+            )
+            covered.add(stratum)
+
+        while deadline is not None and time.monotonic() < deadline:
+            next_file = sampler.next_file()
+            if next_file is None:
+                break
+            stratum, full_filepath = next_file
+            rows = self.collect_file_metrics(full_filepath)
+            code_metrics.extend(rows)
+            file_values.setdefault(stratum, []).append(
+                self.sample_values(rows, complexity_threshold)
+            )
 
-                    code_metrics.extend(
-                        self.calculate_metrics(
-                            full_filepath, file_and_contents, functions
+        estimates = SampleEstimator().estimate(
+            sampler.strata_sizes(), file_values, complexity_threshold
+        )
+        return code_metrics, estimates
+
+    def sample_values(self, rows, complexity_threshold):
+        """
+        Per file quantities that the repo level estimates are built from.
+
+        Skipped files (and skipped archive members) count as zero, the same as in a full run,
+        so they are not filled in at their stratum's mean.
+        """
+        rows = [row for row in rows if not row["skip_reason"].startswith("skipped")]
+        function_rows = [row for row in rows if row["function_name"] != "_FILE_TOTAL"]
+        return {
+            "functions": len(function_rows),
+            "maintainability_sum": sum(
+                row["maintainability_index"] for row in function_rows
+            ),
+            "over_threshold": sum(
+                1 for row in function_rows if row["cyclocomplexity"] > complexity_threshold
+            ),
+            "effort": sum(
+                row["e_effort"] for row in rows if row["function_name"] == "_FILE_TOTAL"
+            ),
+        }
+
+    def collect_archive_metrics(self, archive_path):
+        """
+        Analyze the handled members of an archive in memory, without extracting to disk.
+
+        An unreadable archive or member is recorded as a skipped row rather than stopping the scan.
+        """
+        code_metrics = []
+        members = self.archive_reader.iter_members(archive_path, self.handled_extensions)
+        while True:
+            # only the archive reads are guarded, so errors from the analysis itself still surface
+            try:
+                member_path, member_name, size, read = next(members)
+            except StopIteration:
+                break
+            except self.archive_reader.read_errors as error:
+                code_metrics.append(
+                    self.skipped_row(archive_path, f"skipped: unreadable archive ({error})")
+                )
+                break
+
+            # the size comes from the member header, so oversized members are never read into memory
+            if self.max_file_bytes is not None and size > self.max_file_bytes:
+                skip_reason = self.pre_analysis_skip_reason(size, b"")
+            else:
+                try:
+                    buffer = read()
+                except self.archive_reader.read_errors as error:
+                    code_metrics.append(
+                        self.skipped_row(
+                            member_path, f"skipped: unreadable member ({error})"
                         )
                     )
+                    continue
+                skip_reason = self.pre_analysis_skip_reason(
+                    size, buffer[: self.generated_file_classifier.head_bytes]
+                )
+            if skip_reason:
+                code_metrics.append(self.skipped_row(member_path, skip_reason))
+                continue
+
+            file_and_contents = self.file_reader.read_and_strip_buffer(
+                member_name, buffer
+            )
+            code_metrics.extend(
+                self.analyze_file(archive_path, member_path, file_and_contents)
+            )
 
         return code_metrics
 
+    def analyze_file(self, location, full_filepath, file_and_contents):
+        """Score one file and feed its rows to the rollup as they are produced."""
+        skip_reason = ""
+        line_count = len(file_and_contents["lines"])
+        if self.max_file_lines is not None and line_count > self.max_file_lines:
+            skip_reason = (
+                f"truncated: {line_count} lines > max_file_lines {self.max_file_lines}"
+            )
+            file_and_contents["lines"] = file_and_contents["lines"][: self.max_file_lines]
+
+        deadline = (
+            time.monotonic() + self.max_file_seconds
+            if self.max_file_seconds is not None
+            else None
+        )
+        functions = self.extract_functions(file_and_contents)
+        rows = self.calculate_metrics(
+            full_filepath, file_and_contents, functions, skip_reason, deadline
+        )
+        self.rollup.add_rows(location, rows)
+
+        return rows
+
     def filter_directories(self, dirs):
         return [dir for dir in dirs if dir not in self.directories_to_skip]
 
@@ -578,93 +1555,226 @@ class CodeAnalyzer:
             file_and_contents["lines"], file_and_contents["file_extension"]
         )
 
-    def calculate_metrics(self, full_filepath, file_and_contents, functions):
-        code_metrics = []
+    def calculate_metrics(
+        self, full_filepath, file_and_contents, functions, skip_reason="", deadline=None
+    ):
+        """
+        Scores each function, then derives _FILE_TOTAL from them.
 
-        for function in functions:
-            loc = self.code_metric_calculator.count_lines_of_code(
-                function["function_lines"], file_and_contents["file_extension"]
-            )
-            complexity = self.code_metric_calculator.calc_cyclomatic_complexity(
-                function["function_lines"], file_and_contents["file_extension"]
-            )
-            halstead_metrics = self.code_metric_calculator.calc_halstead_metrics(
-                function["function_lines"], file_and_contents["file_extension"]
+        skip_reason is recorded on every row. Past deadline (time.monotonic), the remaining
+        functions are dropped and the reason is recorded, so the file total covers only the
+        functions scored so far. The deadline is also checked inside a long function, which
+        then keeps its loc but only the complexity and halstead tokens of the lines scored.
+        """
+        code_metrics = []
+        file_extension = file_and_contents["file_extension"]
+
+        # the file total is derived from the function rows, plus top level code, instead of
+        # scoring the whole file a second time
+        loc_file = {"loc_total": 0, "loc_code": 0, "loc_comments": 0}
+        complexity_file = 1  # base complexity, counted once per file
+        N1_operators_file, N2_operands_file = [], []
+
+        for function_number, function in enumerate(functions):
+            if deadline is not None and time.monotonic() > deadline:
+                skip_reason = (
+                    f"truncated: over max_file_seconds {self.max_file_seconds} "
+                    f"after {function_number} of {len(functions)} functions"
+                )
+                break
+            loc, complexity, N1_operators, N2_operands, code_lines_scored = self.score_lines(
+                function["function_lines"], file_extension, deadline
             )
-            maintainability_index = self.calculate_maintainability(
-                halstead_metrics, complexity, loc
+            function_cut_short = code_lines_scored < loc["loc_code"]
+            if function_cut_short:
+                skip_reason = (
+                    f"truncated: over max_file_seconds {self.max_file_seconds} "
+                    f"in {function['function_name']} after {code_lines_scored} of "
+                    f"{loc['loc_code']} code lines"
+                )
+            halstead_metrics = self.code_metric_calculator.calc_halstead_from_tokens(
+                N1_operators, N2_operands
             )
-
             code_metrics.append(
-                {
-                    "run_timestamp": self.timestamp,
-                    "filepath": os.path.dirname(full_filepath),
-                    "file_extension": file_and_contents["file_extension"],
-                    "filename": file_and_contents["filename"],
-                    "function_name": function["function_name"],
-                    **loc,
-                    "cyclocomplexity": complexity,
-                    **halstead_metrics,
-                    "maintainability_index": maintainability_index,
-                }
+                self.build_row(
+                    full_filepath,
+                    file_and_contents,
+                    function["function_name"],
+                    loc,
+                    complexity,
+                    halstead_metrics,
+                )
             )
 
-        # code_metrics += self.calculate_top_level_metrics(full_filepath, file_and_contents)
-        code_metrics.extend(
-            self.calculate_top_level_metrics(full_filepath, file_and_contents)
-        )
-        return code_metrics
+            for key in loc_file:
+                loc_file[key] += loc[key]
+            complexity_file += complexity - 1
+            N1_operators_file.extend(N1_operators)
+            N2_operands_file.extend(N2_operands)
+            if function_cut_short:
+                break
 
-    def calculate_maintainability(self, halstead_metrics, complexity, loc):
-        return self.code_metric_calculator.calc_maintainability(
-            halstead_metrics["v_volume"], complexity, loc["loc_code"]
-        )
-
-    def calculate_top_level_metrics(self, full_filepath, file_and_contents):
         top_level_code = self.function_extractor.extract_top_level_code(
-            file_and_contents["lines"]
+            self.lines_outside_functions(file_and_contents["lines"], functions)
         )
-        loc_module = self.code_metric_calculator.count_lines_of_code(
-            top_level_code[0]["function_lines"], file_and_contents["file_extension"]
+        loc, complexity, N1_operators, N2_operands, code_lines_scored = self.score_lines(
+            top_level_code[0]["function_lines"], file_extension, deadline
         )
-        complexity_module = self.code_metric_calculator.calc_cyclomatic_complexity(
-            top_level_code[0]["function_lines"], file_and_contents["file_extension"]
+        if code_lines_scored < loc["loc_code"] and not skip_reason:
+            skip_reason = (
+                f"truncated: over max_file_seconds {self.max_file_seconds} "
+                f"in top level code after {code_lines_scored} of {loc['loc_code']} code lines"
+            )
+        for key in loc_file:
+            loc_file[key] += loc[key]
+        complexity_file += complexity - 1
+        N1_operators_file.extend(N1_operators)
+        N2_operands_file.extend(N2_operands)
+
+        halstead_metrics_file = self.code_metric_calculator.calc_halstead_from_tokens(
+            N1_operators_file, N2_operands_file
         )
-        halstead_metrics_module = self.code_metric_calculator.calc_halstead_metrics(
-            top_level_code[0]["function_lines"], file_and_contents["file_extension"]
+        code_metrics.append(
+            self.build_row(
+                full_filepath,
+                file_and_contents,
+                top_level_code[0]["function_name"],
+                loc_file,
+                complexity_file,
+                halstead_metrics_file,
+            )
         )
-        maintainability_index_module = self.calculate_maintainability(
-            halstead_metrics_module, complexity_module, loc_module
+
+        for row in code_metrics:
+            row["skip_reason"] = skip_reason
+
+        return code_metrics
+
+    def score_lines(self, lines, file_extension, deadline=None):
+        """Returns loc, complexity, the halstead tokens and the code lines scored of a chunk."""
+        return self.code_metric_calculator.calc_chunk_metrics_until(
+            lines, file_extension, deadline
         )
 
-        return [
-            {
-                "run_timestamp": self.timestamp,
-                "filepath": os.path.dirname(full_filepath),
-                "file_extension": file_and_contents["file_extension"],
-                "filename": file_and_contents["filename"],
-                "function_name": top_level_code[0]["function_name"],
-                **loc_module,
-                "cyclocomplexity": complexity_module,
-                **halstead_metrics_module,
-                "maintainability_index": maintainability_index_module,
-            }
-        ]
+    def lines_outside_functions(self, lines, functions):
+        # extractors assign every line from the first function header onwards to a function,
+        # so only the leading lines (imports, module docstring, etc.) are left over
+        lines_in_functions = sum(len(function["function_lines"]) for function in functions)
+        return lines[: max(0, len(lines) - lines_in_functions)]
+
+    def build_row(
+        self, full_filepath, file_and_contents, function_name, loc, complexity, halstead_metrics
+    ):
+        maintainability_index = self.calculate_maintainability(
+            halstead_metrics, complexity, loc
+        )
+        return {
+            "run_timestamp": self.timestamp,
+            "filepath": self.display_filepath(full_filepath),
+            "file_extension": file_and_contents["file_extension"],
+            "filename": file_and_contents["filename"],
+            "function_name": function_name,
+            **loc,
+            "cyclocomplexity": complexity,
+            **halstead_metrics,
+            "maintainability_index": maintainability_index,
+        }
 
-    def run_analysis(self, target_codepath):
-        code_metrics = self.collect_code_metrics(target_codepath)
+    def display_filepath(self, full_filepath):
+        # archive members are reported whole as "archive!member", files by their directory
+        if "!" in full_filepath and self.archive_reader.is_archive(
+            full_filepath.split("!", 1)[0]
+        ):
+            return full_filepath
+        return os.path.dirname(full_filepath)
+
+    def calculate_maintainability(self, halstead_metrics, complexity, loc):
+        return self.code_metric_calculator.calc_maintainability(
+            halstead_metrics["v_volume"], complexity, loc["loc_code"]
+        )
+
+    def metrics_dataframe(self, code_metrics):
+        """
+        output.csv layout: a fixed column order with skip_reason last, whatever file the walk
+        reached first. Count metrics are nullable Int64, so metric-less skipped rows leave
+        them empty instead of turning every count into a float.
+        """
+        df = pd.DataFrame.from_records(code_metrics, columns=self.output_columns)
+        for column in self.output_columns:
+            if column not in self.output_text_columns + ("d_difficulty",):
+                df[column] = df[column].astype("Int64")
+        df["d_difficulty"] = df["d_difficulty"].astype("Float64")
 
-        # create df
-        df = pd.DataFrame.from_records(code_metrics)
         desired_order = ["filepath", "file_extension", "filename", "function_name"]
         df.sort_values(by=desired_order, inplace=True)
         df.reset_index(drop=True, inplace=True)
+        return df
+
+    def run_analysis(
+        self,
+        target_codepath,
+        sample_fraction=None,
+        time_budget=None,
+        seed=0,
+        complexity_threshold=10,
+    ):
+        """
+        Analyze target_codepath and write output.csv.
+
+        Setting sample_fraction and/or time_budget (seconds) switches to sampling mode: only a
+        stratified random sample of files is analyzed, and repo level estimates with 95%
+        confidence intervals are printed and written to output_estimates.csv.
+        """
+        self.rollup = MetricsRollup(target_codepath, self.top_k)
+        estimates = None
+        if os.path.isfile(target_codepath) and self.archive_reader.is_archive(
+            target_codepath
+        ):
+            # sampling works on files in a directory, an archive is analyzed whole
+            if sample_fraction is not None or time_budget is not None:
+                raise ValueError(
+                    "sample_fraction and time_budget need a directory target, "
+                    f"not the archive {target_codepath}"
+                )
+            code_metrics = self.collect_archive_metrics(target_codepath)
+        elif sample_fraction is not None or time_budget is not None:
+            code_metrics, estimates = self.collect_sampled_metrics(
+                target_codepath, sample_fraction, time_budget, seed, complexity_threshold
+            )
+        else:
+            code_metrics = self.collect_code_metrics(target_codepath)
+
+        df = self.metrics_dataframe(code_metrics)
 
         # print and write to csv
         print(tabulate(df, headers="keys", tablefmt="fancy_grid"))
         output_path = os.path.join(self.module_directory, "output.csv")
         df.to_csv(output_path, index=False)
 
+        # directory/package rollups and worst functions, aggregated while scanning.
+        # in sampling mode they only cover the sampled files, so say so in every row
+        coverage = "sampled files" if estimates is not None else "all files"
+        df_rollup = pd.DataFrame.from_records(self.rollup.rollup_records())
+        df_rollup.insert(0, "coverage", coverage)
+        df_rollup.to_csv(
+            os.path.join(self.module_directory, "output_rollup.csv"), index=False
+        )
+        df_top_k = pd.DataFrame.from_records(self.rollup.top_k_records())
+        df_top_k.insert(0, "coverage", coverage)
+        print(tabulate(df_top_k, headers="keys", tablefmt="fancy_grid"))
+        df_top_k.to_csv(
+            os.path.join(self.module_directory, "output_top_k.csv"), index=False
+        )
+
+        print(f"line cache: {self.code_metric_calculator.line_cache.stats()}")
+
+        if estimates is not None:
+            df_estimates = pd.DataFrame.from_records(estimates)
+            print(tabulate(df_estimates, headers="keys", tablefmt="fancy_grid"))
+            df_estimates.to_csv(
+                os.path.join(self.module_directory, "output_estimates.csv"), index=False
+            )
+
 
 if __name__ == "__main__":
     target_codepath = (
@@ -0,0 +1,80 @@
+import io
+import random
+import tarfile
+import zipfile
+
+from quality import CodeAnalyzer
+
+
+SAMPLE_PY = "def meow(name):\n    x = name + 1\n    return x\n"
+
+
+def analyze(directory):
+    analyzer = CodeAnalyzer(str(directory), [], (".py", ".r", ".sql"))
+    return analyzer.collect_code_metrics(str(directory))
+
+
+def test_archive_members_reported_as_archive_bang_member(tmp_path):
+    with zipfile.ZipFile(tmp_path / "vendored.whl", "w") as archive:
+        archive.writestr("pkg/meow.py", SAMPLE_PY)
+        archive.writestr("pkg/README.txt", "not code")
+
+    rows = analyze(tmp_path)
+
+    assert {row["filepath"] for row in rows} == {f"{tmp_path}/vendored.whl!pkg/meow.py"}
+    assert [row["function_name"] for row in rows] == ["meow", "_FILE_TOTAL"]
+
+
+def test_tar_gz_members_match_plain_file(tmp_path):
+    archive_dir = tmp_path / "archive"
+    plain_dir = tmp_path / "plain"
+    archive_dir.mkdir()
+    plain_dir.mkdir()
+    (plain_dir / "meow.py").write_text(SAMPLE_PY)
+    with tarfile.open(archive_dir / "release.tar.gz", "w:gz") as archive:
+        data = SAMPLE_PY.encode()
+        member = tarfile.TarInfo("meow.py")
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+
+    def metrics(rows):
+        return [
+            {k: v for k, v in row.items() if k not in ("run_timestamp", "filepath")}
+            for row in rows
+        ]
+
+    assert metrics(analyze(archive_dir)) == metrics(analyze(plain_dir))
+
+
+def test_corrupt_archive_is_skipped_not_fatal(tmp_path):
+    (tmp_path / "fixture.zip").write_text("x\n")
+    (tmp_path / "meow.py").write_text(SAMPLE_PY)
+
+    rows = analyze(tmp_path)
+
+    skipped = [row for row in rows if row["filename"] == "fixture.zip"]
+    assert len(skipped) == 1
+    assert skipped[0]["skip_reason"].startswith("skipped: unreadable archive")
+    assert [row["function_name"] for row in rows if row["filename"] == "meow.py"] == [
+        "meow",
+        "_FILE_TOTAL",
+    ]
+
+
+def test_truncated_tar_gz_is_skipped_not_fatal(tmp_path):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        rng = random.Random(0)
+        data = "".join(
+            f"x{rng.getrandbits(32)} = y{rng.getrandbits(32)}\n" for _ in range(2000)
+        ).encode()  # incompressible, so the cut lands inside the member
+        member = tarfile.TarInfo("meow.py")
+        member.size = len(data)
+        archive.addfile(member, io.BytesIO(data))
+    (tmp_path / "release.tar.gz").write_bytes(buffer.getvalue()[:2000])
+
+    rows = analyze(tmp_path)
+
+    # the member fails to read, then the stream behind it fails too
+    assert rows[0]["skip_reason"].startswith("skipped: unreadable member")
+    assert all(row["skip_reason"].startswith("skipped: unreadable") for row in rows)
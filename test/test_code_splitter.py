@@ -0,0 +1,39 @@
+from quality import CodeMetricsCalculator, CodeSplitter
+
+
+def test_repeated_lines_in_comment_block_are_each_counted():
+    # before the quadratic "line not in comment_lines" search was replaced, a line repeating
+    # an earlier comment line was dropped, giving 3 comment lines here
+    lines = ["/* header", "x: value", "x: value", "*/", "select a", "from t"]
+
+    code_lines, comment_lines = CodeSplitter().split_into_code_lines_and_comment_lines(
+        lines, ".sql"
+    )
+
+    assert code_lines == ["select a", "from t"]
+    assert comment_lines == ["/* header", "x: value", "x: value", "*/"]
+
+
+def test_repeated_docstring_lines_counted_in_loc_comments():
+    lines = [
+        "def meow(name):",
+        '"""',
+        "name: str",
+        "returns:",
+        "name: str",
+        'meow"""',
+        "return name",
+    ]
+
+    loc = CodeMetricsCalculator().count_lines_of_code(lines, ".py")
+
+    assert loc == {"loc_total": 7, "loc_code": 2, "loc_comments": 5}
+
+
+def test_unhandled_extension_counts_everything_as_code():
+    lines = ["fn main() {", "// comment", "}"]
+
+    assert CodeSplitter().split_into_code_lines_and_comment_lines(lines, ".rs") == (
+        lines,
+        [],
+    )
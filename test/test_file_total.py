@@ -0,0 +1,57 @@
+from quality import CodeAnalyzer
+
+
+MODULE_WITH_DOCSTRINGS = '''"""
+Module docstring.
+"""
+import os
+
+
+def meow(name):
+    """
+    say meow
+    """
+    x = name + 1
+    return x
+
+
+def purr(name):
+    """
+    say purr
+    """
+    if name > 1:
+        y = name * 2
+        return y
+    return name - 1
+'''
+
+
+def file_rows(tmp_path):
+    (tmp_path / "mod.py").write_text(MODULE_WITH_DOCSTRINGS)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+    return {
+        row["function_name"]: row for row in analyzer.collect_code_metrics(str(tmp_path))
+    }
+
+
+def test_file_total_is_derived_from_function_rows(tmp_path):
+    rows = file_rows(tmp_path)
+    total = rows["_FILE_TOTAL"]
+
+    # top level lines (module docstring and import) are the 4 lines before "def meow"
+    assert total["loc_total"] == rows["meow"]["loc_total"] + rows["purr"]["loc_total"] + 4
+    assert total["N1_operators_total"] == (
+        rows["meow"]["N1_operators_total"] + rows["purr"]["N1_operators_total"]
+    )
+
+
+def test_file_total_values(tmp_path):
+    # each function is split on its own, so comment block state does not carry across
+    # function boundaries. scoring the whole file in one split gave loc_code 3,
+    # loc_comments 15 and maintainability_index 83 for this module
+    total = file_rows(tmp_path)["_FILE_TOTAL"]
+
+    assert (total["loc_total"], total["loc_code"], total["loc_comments"]) == (18, 4, 14)
+    assert total["cyclocomplexity"] == 1
+    assert total["v_volume"] == 10
+    assert total["maintainability_index"] == 79
@@ -0,0 +1,81 @@
+from quality import CodeMetricsCalculator, LineCache
+
+
+def test_put_existing_key_does_not_double_count_bytes():
+    cache = LineCache()
+    key = (".py", "return x")
+    value = (("return ",), ("x",), 0)
+
+    cache.put(key, value)
+    single_entry_bytes = cache.bytes
+    cache.put(key, value)
+
+    assert cache.stats()["entries"] == 1
+    assert cache.bytes == single_entry_bytes == cache.entry_size(key, value)
+
+
+def test_evicts_least_recently_used_past_entry_cap():
+    cache = LineCache(max_entries=2)
+    cache.put((".py", "a"), ((), ("a",), 0))
+    cache.put((".py", "b"), ((), ("b",), 0))
+    cache.get((".py", "a"))  # a is now the most recently used
+    cache.put((".py", "c"), ((), ("c",), 0))
+
+    assert cache.get((".py", "b")) is None
+    assert cache.get((".py", "a")) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_byte_cap_bounds_memory():
+    value = ((), ("x",), 0)
+    entry_bytes = LineCache().entry_size((".py", "line 0"), value)
+    cache = LineCache(max_bytes=entry_bytes * 3)
+    for i in range(10):
+        cache.put((".py", f"line {i}"), value)
+
+    assert cache.bytes <= entry_bytes * 3
+    assert cache.stats()["entries"] == 3
+    assert cache.stats()["evictions"] == 7
+
+
+def test_hit_rate():
+    cache = LineCache()
+    cache.get((".py", "a"))
+    cache.put((".py", "a"), ((), ("a",), 0))
+    cache.get((".py", "a"))
+    cache.get((".py", "a"))
+
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+    assert stats["hit_rate"] == round(2 / 3, 4)
+
+
+def test_chunk_looks_each_line_up_once():
+    calculator = CodeMetricsCalculator()
+    lines = [f"x{i} = y{i} + {i}" for i in range(100)]
+
+    calculator.calc_chunk_metrics(lines, ".py")
+
+    assert calculator.line_cache.stats()["hit_rate"] == 0
+    calculator.calc_chunk_metrics(lines, ".py")
+    assert calculator.line_cache.stats()["hit_rate"] == 0.5
+
+
+def test_chunk_metrics_match_separate_metrics():
+    calculator = CodeMetricsCalculator()
+    lines = [
+        "def meow(name):",
+        '"""',
+        "say meow",
+        '"""',
+        "# comment",
+        "if name == 1 and name != 2:",
+        "x = name + 1",
+        "return x",
+    ]
+
+    loc, complexity, operators, operands = calculator.calc_chunk_metrics(lines, ".py")
+
+    assert loc == calculator.count_lines_of_code(lines, ".py")
+    assert complexity == calculator.calc_cyclomatic_complexity(lines, ".py")
+    assert (operators, operands) == calculator.tokenize_halstead(lines, ".py")
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from quality import CodeAnalyzer, QuantileSketch, RunningStats
+
+
+SAMPLE_PY = "def meow(name):\n    x = name + 1\n    return x\n"
+
+
+def test_relative_target_rolls_up_under_one_key(tmp_path, monkeypatch):
+    (tmp_path / "c4" / "sub").mkdir(parents=True)
+    (tmp_path / "c4" / "a.py").write_text(SAMPLE_PY)
+    (tmp_path / "c4" / "sub" / "b.py").write_text(SAMPLE_PY)
+    (tmp_path / "c4" / "sub" / "c.py").write_text(SAMPLE_PY)
+    monkeypatch.chdir(tmp_path)
+
+    analyzer = CodeAnalyzer("c4", [], (".py",))
+    analyzer.collect_code_metrics("c4")
+    records = analyzer.rollup.rollup_records()
+
+    file_counts = {
+        (record["level"], record["key"]): record["count"]
+        for record in records
+        if record["scope"] == "file"
+    }
+    assert file_counts == {
+        ("directory", str(tmp_path / "c4")): 3,
+        ("directory", str(tmp_path / "c4" / "sub")): 2,
+        ("package", "."): 1,
+        ("package", "sub"): 2,
+    }
+
+
+def test_quantile_sketch_within_relative_accuracy():
+    rng = random.Random(0)
+    values = [rng.lognormvariate(3, 1.5) for _ in range(5000)]
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    exact = sorted(values)
+    for q in (0.0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1.0):
+        expected = exact[int(q * (len(exact) - 1))]
+        assert abs(sketch.quantile(q) - expected) <= 0.01 * expected
+
+
+def test_quantile_sketch_merge_matches_single_sketch():
+    rng = random.Random(1)
+    values = [rng.randint(0, 100) for _ in range(1000)]
+    single = QuantileSketch()
+    left = QuantileSketch()
+    right = QuantileSketch()
+    for i, value in enumerate(values):
+        single.add(value)
+        (left if i % 3 else right).add(value)
+
+    left.merge(right)
+
+    assert left.count == single.count
+    assert left.zero_count == single.zero_count
+    assert left.buckets == single.buckets
+    for q in (0.1, 0.5, 0.9):
+        assert left.quantile(q) == single.quantile(q)
+
+
+def test_quantile_sketch_zeros_and_empty():
+    sketch = QuantileSketch()
+    assert sketch.quantile(0.5) is None
+
+    for value in (0, 0, 0, 50):
+        sketch.add(value)
+
+    assert sketch.zero_count == 3
+    assert sketch.quantile(0.5) == 0
+    assert abs(sketch.quantile(1.0) - 50) <= 0.01 * 50
+
+
+def test_quantile_sketch_refuses_to_merge_different_accuracy():
+    with pytest.raises(ValueError):
+        QuantileSketch(0.01).merge(QuantileSketch(0.05))
+
+
+def metric_row(**overrides):
+    row = {metric: 0 for metric in RunningStats.metrics}
+    row.update(overrides)
+    return row
+
+
+def test_running_stats_merge_matches_single():
+    rows = [metric_row(loc_total=i, maintainability_index=i * 10) for i in range(1, 7)]
+    single = RunningStats()
+    left = RunningStats()
+    right = RunningStats()
+    for i, row in enumerate(rows):
+        single.add(row)
+        (left if i < 2 else right).add(row)
+
+    left.merge(right)
+
+    assert left.summary() == single.summary()
+    summary = single.summary()
+    assert (summary["count"], summary["loc_total_sum"], summary["loc_total_max"]) == (6, 21, 6)
+    assert summary["loc_total_mean"] == 3.5
+
+
+def test_running_stats_empty_summary():
+    summary = RunningStats().summary()
+
+    assert summary["count"] == 0
+    assert summary["loc_total_mean"] is None
+    assert summary["maintainability_index_p50"] is None
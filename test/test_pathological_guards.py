@@ -0,0 +1,190 @@
+import random
+import time
+
+from quality import CodeAnalyzer, GeneratedFileClassifier
+
+
+SAMPLE_PY = "def meow(name):\n    x = name + 1\n    return x\n"
+
+
+def test_hand_written_code_is_not_flagged():
+    with open(__file__, "rb") as file:
+        head = file.read(GeneratedFileClassifier.head_bytes)
+
+    assert GeneratedFileClassifier().classify(head) is None
+    assert GeneratedFileClassifier().classify(b"") is None
+
+
+def test_generated_marker_in_header():
+    head = b"# Code generated by protoc. DO NOT EDIT.\n" + SAMPLE_PY.encode()
+
+    assert GeneratedFileClassifier().classify(head).startswith("generated")
+
+
+def test_generated_marker_below_header_is_ignored():
+    # e.g. a linter that mentions "@generated" in its own source
+    head = b"x = 1\n" * 20 + b'markers = ["@generated"]\n'
+
+    assert GeneratedFileClassifier().classify(head) is None
+
+
+def test_long_line_is_minified():
+    head = b"def f(a): " + b";".join(b"x%d=a+%d" % (i, i) for i in range(300)) + b"\n"
+
+    assert GeneratedFileClassifier().classify(head).startswith("minified (line of")
+
+
+def test_long_mean_line_is_minified():
+    head = (b"x" * 400 + b"\n") * 10
+
+    assert GeneratedFileClassifier().classify(head).startswith("minified (mean line")
+
+
+def test_line_cut_by_the_head_read_is_not_counted():
+    classifier = GeneratedFileClassifier()
+    body = b"x = 1\n" * 1000
+    cut_line = b"y" * (classifier.head_bytes - len(body))  # longer than max_line_length
+
+    # a full head: the last line was cut by the read, so its length is unknown
+    assert classifier.classify(body + cut_line) is None
+    # a whole (short) file: the last line is complete, so it counts
+    assert classifier.classify(b"x = 1\n" * 10 + cut_line).startswith("minified")
+
+
+def test_high_entropy_is_encoded_or_binary():
+    rng = random.Random(0)
+    lines = [bytes(rng.randint(11, 255) for _ in range(80)) for _ in range(50)]
+
+    assert GeneratedFileClassifier().classify(b"\n".join(lines)).startswith(
+        "encoded or binary"
+    )
+
+
+def test_null_byte_is_binary():
+    assert GeneratedFileClassifier().classify(b"x = 1\n\x00\x01") == "binary (null bytes)"
+
+
+def test_oversized_and_generated_files_are_skipped_before_reading(tmp_path):
+    (tmp_path / "big.py").write_text(SAMPLE_PY * 100)
+    (tmp_path / "gen.py").write_text("# @generated\n" + SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",), max_file_bytes=1000)
+
+    rows = {row["filename"]: row for row in analyzer.collect_code_metrics(str(tmp_path))}
+
+    assert rows["big.py"]["skip_reason"].startswith("skipped: 4600 bytes > max_file_bytes 1000")
+    assert rows["gen.py"]["skip_reason"].startswith("skipped: generated")
+    assert "loc_total" not in rows["big.py"]
+    assert analyzer.rollup.directories == {}
+
+
+def test_skip_generated_false_analyzes_generated_files(tmp_path):
+    (tmp_path / "gen.py").write_text("# @generated\n" + SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",), skip_generated=False)
+
+    rows = analyzer.collect_code_metrics(str(tmp_path))
+
+    assert [row["skip_reason"] for row in rows] == ["", ""]
+
+
+def test_max_file_lines_truncates(tmp_path):
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".sql",), max_file_lines=5)
+    file_and_contents = {
+        "filename": "seed.sql",
+        "file_extension": ".sql",
+        "lines": [f"insert into t values ({i})" for i in range(12)],
+    }
+
+    rows = analyzer.analyze_file(str(tmp_path), str(tmp_path / "seed.sql"), file_and_contents)
+
+    assert {row["skip_reason"] for row in rows} == {
+        "truncated: 12 lines > max_file_lines 5"
+    }
+    assert rows[-1]["function_name"] == "_FILE_TOTAL"
+    assert rows[-1]["loc_total"] == 5
+
+
+def test_max_file_seconds_drops_remaining_functions(tmp_path):
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",), max_file_seconds=3)
+    lines = ["import os", "def meow(a):", "return a", "def purr(a):", "return a"]
+    file_and_contents = {"filename": "m.py", "file_extension": ".py", "lines": lines}
+    functions = analyzer.extract_functions(file_and_contents)
+
+    rows = analyzer.calculate_metrics(
+        str(tmp_path / "m.py"),
+        file_and_contents,
+        functions,
+        deadline=time.monotonic() - 1,  # already past
+    )
+
+    assert [row["function_name"] for row in rows] == ["_FILE_TOTAL"]
+    assert rows[0]["skip_reason"] == (
+        "truncated: over max_file_seconds 3 after 0 of 2 functions"
+    )
+    assert rows[0]["loc_total"] == 1  # only the top level "import os"
+
+
+def test_max_file_seconds_cuts_a_long_function_short(tmp_path, monkeypatch):
+    # a .sql file is one "none" function, so the budget has to be checked inside it
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".sql",), max_file_seconds=3)
+    lines = [f"select a{i} from t where b = {i}" for i in range(3000)]
+    file_and_contents = {"filename": "q.sql", "file_extension": ".sql", "lines": lines}
+    functions = analyzer.extract_functions(file_and_contents)
+    clock = iter([0])  # within budget between functions, past it from then on
+    monkeypatch.setattr("quality.time.monotonic", lambda: next(clock, 100))
+
+    rows = analyzer.calculate_metrics(
+        str(tmp_path / "q.sql"), file_and_contents, functions, deadline=50
+    )
+
+    assert [row["function_name"] for row in rows] == ["none", "_FILE_TOTAL"]
+    assert {row["skip_reason"] for row in rows} == {
+        "truncated: over max_file_seconds 3 in none after 1000 of 3000 code lines"
+    }
+    assert rows[0]["loc_code"] == 3000
+    assert rows[0]["cyclocomplexity"] == 1 + 3 * 1000  # select, from, where per line scored
+
+
+def test_clean_files_have_empty_skip_reason(tmp_path):
+    (tmp_path / "meow.py").write_text(SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+
+    rows = analyzer.collect_code_metrics(str(tmp_path))
+
+    assert [row["skip_reason"] for row in rows] == ["", ""]
+
+
+def test_skipped_rows_keep_output_layout_and_types(tmp_path):
+    # "a_gen.py" sorts and walks first, so its metric-less row would set the column order
+    (tmp_path / "a_gen.py").write_text("# @generated\n" + SAMPLE_PY)
+    (tmp_path / "b_ok.py").write_text(SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+    analyzer.module_directory = str(tmp_path)  # keep outputs out of the repo
+
+    analyzer.run_analysis(str(tmp_path))
+
+    with open(tmp_path / "output.csv") as file:
+        header, *lines = file.read().splitlines()
+    assert header.split(",") == list(CodeAnalyzer.output_columns)
+    assert header.split(",")[-1] == "skip_reason"
+    ok_total = next(line for line in lines if "b_ok.py,_FILE_TOTAL" in line).split(",")
+    loc_total = ok_total[CodeAnalyzer.output_columns.index("loc_total")]
+    assert loc_total == "3"  # not "3.0"
+    skipped = next(line for line in lines if "a_gen.py" in line).split(",")
+    assert skipped[CodeAnalyzer.output_columns.index("loc_total")] == ""
+
+
+def test_short_single_line_file_is_not_minified():
+    # one hand written query, no trailing newline: a 201 char mean line, but tiny
+    query = b"select customer_id, order_id, sum(amount) as total from orders " + (
+        b"where status = 'shipped' and region = 'emea' group by customer_id, order_id "
+        b"having sum(amount) > 1000 and count(order_line_id) > 3 order by total desc"
+    )
+    assert len(query) > GeneratedFileClassifier.max_mean_line_length
+
+    assert GeneratedFileClassifier().classify(query) is None
+
+
+def test_short_file_is_still_checked_for_markers():
+    assert GeneratedFileClassifier().classify(b"-- @generated\nselect 1").startswith(
+        "generated"
+    )
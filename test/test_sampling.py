@@ -0,0 +1,270 @@
+import math
+import os
+import zipfile
+
+import pandas as pd
+import pytest
+
+import quality
+from quality import CodeAnalyzer, SampleEstimator, StratifiedSampler
+
+
+SAMPLE_PY = "def meow(name):\n    x = name + 1\n    y = x * name - 2\n    return y\n"
+
+
+def test_skipped_files_count_as_zero_in_estimates(tmp_path):
+    for i in range(5):
+        (tmp_path / f"ok_{i}.py").write_text(SAMPLE_PY)
+        (tmp_path / f"gen_{i}.py").write_text("# @generated\n" + SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+
+    full_rows = analyzer.collect_code_metrics(str(tmp_path))
+    true_total = sum(
+        row["e_effort"]
+        for row in full_rows
+        if row["function_name"] == "_FILE_TOTAL" and not row["skip_reason"]
+    )
+    _, estimates = analyzer.collect_sampled_metrics(
+        str(tmp_path), 1.0, None, 0, complexity_threshold=10
+    )
+    total_effort = next(e for e in estimates if e["metric"] == "total_e_effort")
+
+    assert true_total > 0
+    assert total_effort["estimate"] == true_total
+    assert total_effort["ci_low"] == total_effort["ci_high"] == true_total
+
+
+def test_sampler_strata_by_extension_and_size():
+    sampler = StratifiedSampler(
+        [("a.py", 100), ("b.py", 1500), ("c.py", 3000), ("d.sql", 100)], seed=0
+    )
+
+    assert sampler.strata_sizes() == {
+        (".py", 0): 1,  # under 1KB
+        (".py", 1): 1,  # 1-2KB
+        (".py", 2): 1,  # 2-4KB
+        (".sql", 0): 1,
+    }
+
+
+def test_sampler_allocation_is_proportional_with_a_minimum():
+    files = [(f"f{i}.py", 100) for i in range(40)] + [(f"q{i}.sql", 100) for i in range(3)]
+    sampler = StratifiedSampler(files, seed=0)
+
+    sample = sampler.initial_sample(0.1)
+    taken = [stratum for stratum, _ in sample]
+
+    assert taken.count((".py", 0)) == 4  # 10% of 40
+    assert taken.count((".sql", 0)) == 2  # minimum of 2, though 10% of 3 rounds to 0
+    assert taken[:2] == [(".py", 0), (".sql", 0)]  # round robin, so a cut covers both
+
+
+def test_sampler_is_repeatable_for_a_seed():
+    files = [(f"f{i}.py", 100 * i) for i in range(50)]
+
+    def draw(seed):
+        sampler = StratifiedSampler(files, seed=seed)
+        sample = sampler.initial_sample(0.2)
+        while True:
+            next_file = sampler.next_file()
+            if next_file is None:
+                return sample
+            sample.append(next_file)
+
+    assert draw(1) == draw(1)
+    assert draw(1) != draw(2)
+    # growing the sample eventually takes every file exactly once
+    assert sorted(path for _, path in draw(1)) == sorted(path for path, _ in files)
+
+
+def test_sampler_grows_the_least_sampled_stratum():
+    files = [(f"f{i}.py", 100) for i in range(10)] + [(f"q{i}.sql", 100) for i in range(4)]
+    sampler = StratifiedSampler(files, seed=0)
+    sampler.initial_sample(0)  # 2 of 10 .py, 2 of 4 .sql
+
+    stratum, _ = sampler.next_file()
+
+    assert stratum == (".py", 0)
+
+
+def value(effort=0, functions=0, maintainability_sum=0, over_threshold=0):
+    return {
+        "effort": effort,
+        "functions": functions,
+        "maintainability_sum": maintainability_sum,
+        "over_threshold": over_threshold,
+    }
+
+
+def test_stratified_total_with_finite_population_correction():
+    # stratum a: N=4, sampled 10 and 20 -> 4 * 15 = 60, s^2 = 50,
+    #   variance = 4^2 * (1 - 2/4) * 50 / 2 = 200
+    # stratum b: N=2, fully sampled -> 10, no variance left after the correction
+    strata_sizes = {"a": 4, "b": 2}
+    file_values = {
+        "a": [value(effort=10), value(effort=20)],
+        "b": [value(effort=5), value(effort=5)],
+    }
+
+    total = SampleEstimator().total("total", strata_sizes, file_values, "effort")
+
+    margin = 1.96 * math.sqrt(200)
+    assert total == {
+        "metric": "total",
+        "estimate": 70,
+        "ci_low": round(70 - margin, 2),
+        "ci_high": round(70 + margin, 2),
+    }
+
+
+def test_stratified_ratio():
+    # numerator total = 4 * 150/2 + 2 * 120/2 = 420, denominator = 4 * 3/2 + 2 * 2/2 = 8
+    # ratio = 52.5. residuals in a: 100 - 2*52.5 = -5, 50 - 52.5 = -2.5, s^2 = 3.125,
+    # variance = 4^2 * (1 - 2/4) * 3.125 / 2 / 8^2
+    strata_sizes = {"a": 4, "b": 2}
+    file_values = {
+        "a": [
+            value(functions=2, maintainability_sum=100),
+            value(functions=1, maintainability_sum=50),
+        ],
+        "b": [
+            value(functions=1, maintainability_sum=60),
+            value(functions=1, maintainability_sum=60),
+        ],
+    }
+
+    ratio = SampleEstimator().ratio(
+        "mean", strata_sizes, file_values, "maintainability_sum", "functions"
+    )
+
+    margin = 1.96 * math.sqrt(16 * 0.5 * 3.125 / 2 / 64)
+    assert ratio["estimate"] == 52.5
+    assert ratio["ci_low"] == round(52.5 - margin, 2)
+    assert ratio["ci_high"] == round(52.5 + margin, 2)
+
+
+def test_single_sampled_file_leaves_interval_unknown():
+    estimator = SampleEstimator()
+
+    assert estimator.stratum_variance(3, [7]) is None
+    total = estimator.total("total", {"a": 3}, {"a": [value(effort=7)]}, "effort")
+    assert (total["estimate"], total["ci_low"], total["ci_high"]) == (21, None, None)
+
+    ratio = estimator.ratio(
+        "mean",
+        {"a": 3, "b": 2},
+        {
+            "a": [value(functions=1, maintainability_sum=50)],
+            "b": [value(functions=1, maintainability_sum=70)] * 2,
+        },
+        "maintainability_sum",
+        "functions",
+    )
+    assert ratio["estimate"] == round((3 * 50 + 2 * 70) / 5, 2)
+    assert (ratio["ci_low"], ratio["ci_high"]) == (None, None)
+
+
+def test_fully_sampled_stratum_adds_no_variance():
+    estimator = SampleEstimator()
+
+    assert estimator.stratum_variance(1, [7]) == 0
+    assert estimator.stratum_variance(2, [7, 9]) == 0
+    total = estimator.total("total", {"a": 1}, {"a": [value(effort=7)]}, "effort")
+    assert (total["estimate"], total["ci_low"], total["ci_high"]) == (7, 7, 7)
+
+
+def test_ratio_without_functions_has_no_estimate():
+    ratio = SampleEstimator().ratio(
+        "mean", {"a": 2}, {"a": [value(), value()]}, "maintainability_sum", "functions"
+    )
+
+    assert ratio["estimate"] is None
+
+
+def test_estimate_reports_all_metrics_and_file_counts():
+    estimates = SampleEstimator().estimate(
+        {"a": 4},
+        {"a": [value(1, 2, 100, 1), value(3, 2, 120, 0)]},
+        complexity_threshold=10,
+    )
+
+    assert [e["metric"] for e in estimates] == [
+        "mean_maintainability_index",
+        "total_e_effort",
+        "share_functions_cyclocomplexity_over_10",
+    ]
+    assert [e["estimate"] for e in estimates] == [55, 8, 0.25]
+    assert all(e["files_sampled"] == 2 and e["files_total"] == 4 for e in estimates)
+
+
+def test_sampling_mode_labels_rollups_as_partial(tmp_path):
+    for i in range(4):
+        (tmp_path / f"ok_{i}.py").write_text(SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+    analyzer.module_directory = str(tmp_path)  # keep outputs out of the repo
+
+    analyzer.run_analysis(str(tmp_path), sample_fraction=0.5)
+
+    for output in ("output_rollup.csv", "output_top_k.csv"):
+        coverage = pd.read_csv(tmp_path / output)["coverage"]
+        assert set(coverage) == {"sampled files"}
+
+
+class FakeClock:
+    """Stands in for time.monotonic. Each analyzed file takes one second."""
+
+    def __init__(self, analyzer, monkeypatch):
+        self.now = 0
+        self.analyzed = []
+        monkeypatch.setattr(quality.time, "monotonic", lambda: self.now)
+        collect_file_metrics = analyzer.collect_file_metrics
+
+        def timed_collect_file_metrics(full_filepath):
+            self.analyzed.append(os.path.basename(full_filepath))
+            self.now += 1
+            return collect_file_metrics(full_filepath)
+
+        monkeypatch.setattr(analyzer, "collect_file_metrics", timed_collect_file_metrics)
+
+
+def test_time_budget_grows_sample_until_deadline(tmp_path, monkeypatch):
+    for i in range(10):
+        (tmp_path / f"ok_{i}.py").write_text(SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",), max_file_seconds=None)
+    clock = FakeClock(analyzer, monkeypatch)
+
+    _, estimates = analyzer.collect_sampled_metrics(
+        str(tmp_path), None, 3.5, 0, complexity_threshold=10
+    )
+
+    # the minimum 2 files take until t=2, then one file at t=2 and one at t=3
+    assert len(clock.analyzed) == 4
+    assert len(set(clock.analyzed)) == 4
+    assert all(e["files_sampled"] == 4 and e["files_total"] == 10 for e in estimates)
+
+
+def test_past_deadline_still_samples_one_file_per_stratum(tmp_path, monkeypatch):
+    for i in range(4):
+        (tmp_path / f"ok_{i}.py").write_text(SAMPLE_PY)
+        (tmp_path / f"q_{i}.sql").write_text("select a, b\nfrom t\nwhere a = 1\n")
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py", ".sql"), max_file_seconds=None)
+    clock = FakeClock(analyzer, monkeypatch)
+
+    _, estimates = analyzer.collect_sampled_metrics(
+        str(tmp_path), 1.0, 0.5, 0, complexity_threshold=10
+    )
+
+    assert sorted(os.path.splitext(name)[1] for name in clock.analyzed) == [".py", ".sql"]
+    total_effort = next(e for e in estimates if e["metric"] == "total_e_effort")
+    assert total_effort["files_sampled"] == 2
+    assert (total_effort["ci_low"], total_effort["ci_high"]) == (None, None)
+
+
+def test_sampling_an_archive_target_is_refused(tmp_path):
+    with zipfile.ZipFile(tmp_path / "release.zip", "w") as archive:
+        archive.writestr("meow.py", SAMPLE_PY)
+    analyzer = CodeAnalyzer(str(tmp_path), [], (".py",))
+    analyzer.module_directory = str(tmp_path)
+
+    with pytest.raises(ValueError):
+        analyzer.run_analysis(str(tmp_path / "release.zip"), sample_fraction=0.5)